@@ -1,118 +1,202 @@
-import requests
-import argparse
+import functools
+import hashlib
+import io
 import logging
 import sys
 import os
-import json  # Added for caching
+import threading
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta
-from dotenv import load_dotenv  # Added for .env loading
-
-# Load .env file from the script's directory
-load_dotenv()
-if os.path.exists(".env"):
-    logging.info("Loaded configuration from .env file.")
-else:
-    logging.info(".env file not found; using system environment variables or CLI args.")
-
-# Configure logging to output to stdout by default
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    stream=sys.stdout,
-)
+
+# Prefer orjson for (de)serialization; fall back to stdlib json if unavailable
+try:
+    import orjson
+
+    def _loads(b):
+        return orjson.loads(b)
+
+    def _dumps(o):
+        return orjson.dumps(o)
+
+except ImportError:
+    import json
+
+    _loads = json.loads
+
+    def _dumps(o):
+        return json.dumps(o).encode()
 
 REPORT_WIDTH = 80  
+CACHE_TTL_SECONDS = 3600  # Freshness window for cached prices of the current day
+CACHE_FORMAT_VERSION = 2  # Bump when the layout of cached price files changes
+
+# Zero-padded hour labels and their successors, indexed by hour
+_HOUR_STRS = tuple(f"{i:02d}" for i in range(24))
+_NEXT_HOUR = tuple(_HOUR_STRS[(i + 1) % 24] for i in range(24))
+_SPARK_BARS = "▁▂▃▄▅▆▇█"
+
+# Shared HTTP session so repeated requests reuse pooled keep-alive connections.
+# Created on first use, so runs served entirely from cache never import requests
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    """Returns the shared requests session, creating it on first call."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            session = requests.Session()
+            session.mount(
+                "https://",
+                HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=4,
+                    max_retries=Retry(total=2, backoff_factor=0.3),
+                ),
+            )
+            session.headers.update(
+                {"Accept-Encoding": "gzip", "User-Agent": "aura-cli/1"}
+            )
+            _session = session
+    return _session
 
 
+@functools.lru_cache(maxsize=512)
 def format_price(price: float, max_decimals: int = 4) -> str:
     """
     Formats a float price, trimming trailing zeros and decimal point if unnecessary.
     e.g., 2.3300 -> '2.33', 2.0000 -> '2', 2.2633 -> '2.2633'
     """
+    # -0.0 and 0.0 share a cache entry, so fold the sign to render both alike
+    price += 0.0
     formatted = f"{price:.{max_decimals}f}"
-    formatted = formatted.rstrip("0").rstrip(".") if "." in formatted else formatted
-    return formatted
+    return formatted.rstrip("0").rstrip(".") if max_decimals > 0 else formatted
+
+
+def _stale_fallback(stale_prices, date_str: str):
+    """Returns expired cached prices (if any) when a refresh fails."""
+    if stale_prices is not None:
+        logging.warning(f"Using stale cached prices for {date_str}.")
+    return stale_prices
 
 
 def fetch_prices(date_str: str, cache_dir: str = ".cache"):
-    
+    """
+    Returns the day's DK1 prices as a 24-slot list indexed by hour, with None
+    for hours that have no data, or None if nothing could be fetched.
+    """
+    base_url = "https://www.aura.dk/api/hour-price/data"
+    content_ref = "40291"
+    url = f"{base_url}?date={date_str}&currentBlockContentReference={content_ref}"
+
+    # Key the cache file on the data source as well as the date, so a new
+    # endpoint, content reference or file format never picks up old entries
+    key = hashlib.blake2b(
+        f"{CACHE_FORMAT_VERSION}|{base_url}|{content_ref}|{date_str}".encode(),
+        digest_size=8,
+    ).hexdigest()
     cache_file = os.path.join(
-        cache_dir, f"prices_{date_str.replace('/', '')}.json"
+        cache_dir, f"prices_{date_str.replace('/', '')}_{key}.json"
     )
     os.makedirs(cache_dir, exist_ok=True)
 
-    # Check cache first
+    # Past days never change, so their cache is served regardless of age;
+    # anything else is only served within the TTL, but kept as a fallback
+    is_past = datetime.strptime(date_str, "%Y/%m/%d").date() < datetime.now().date()
+    stale_prices = None
     if os.path.exists(cache_file):
         try:
-            with open(cache_file, "r") as f:
+            age = time.time() - os.stat(cache_file).st_mtime
+            with open(cache_file, "rb") as f:
+                cached_prices = _loads(f.read())
+            if is_past or age < CACHE_TTL_SECONDS:
                 logging.info(f"Loading cached prices for {date_str}")
-                return json.load(f)
-        except (json.JSONDecodeError, IOError) as e:
+                return cached_prices
+            logging.info(f"Cached prices for {date_str} are stale. Refreshing.")
+            stale_prices = cached_prices
+        except (ValueError, IOError) as e:
             logging.warning(f"Cache read error for {date_str}: {e}. Fetching fresh.")
 
-    base_url = "https://www.aura.dk/api/hour-price/data"
-    content_ref = "40291"
-    url = f"{base_url}?date={date_str}&currentBlockContentReference={content_ref}"
+    session = _get_session()
+    import requests  # Already loaded by _get_session()
 
     try:
         logging.info(f"Fetching prices for {date_str} ...")
-        response = requests.get(url, timeout=10)
+        response = session.get(url, timeout=10)
         response.raise_for_status()
-        data = response.json()
+        data = _loads(response.content)
     except requests.RequestException as e:  # Streamlined exception handling
         logging.error(f"Error fetching data for {date_str}: {e}")
-        return None
+        return _stale_fallback(stale_prices, date_str)
     except ValueError as e:
         logging.error(f"Failed to parse JSON: {e}")
-        return None
+        return _stale_fallback(stale_prices, date_str)
 
     chart_series = data.get("chartSeries")
     if not chart_series or not isinstance(chart_series, list):
         logging.error("No valid 'chartSeries' data found.")
-        return None
-
-    hourly_totals = {}
-    for hour_idx in range(24):
-        hour_str = f"{hour_idx:02d}"
-        total = 0.0
-        found = False
-        for series in chart_series:
-            for tp in series.get("timePoints", []):
-                if tp.get("name") == hour_str:
-                    price = tp.get("priceWestDenmark")
-                    if price is not None:
-                        try:
-                            total += float(price)
-                            found = True
-                        except ValueError:
-                            logging.warning(
-                                f"Skipping invalid price '{price}' for {hour_str}."
-                            )
-        if found:
-            hourly_totals[hour_str] = round(total, 4)
+        return _stale_fallback(stale_prices, date_str)
+
+    # Single pass over all time points, summing prices per hour name. Time
+    # points normally carry both keys, so index directly and skip the odd one out
+    totals = defaultdict(float)
+    seen = set()
+    for series in chart_series:
+        for tp in series.get("timePoints") or ():
+            try:
+                name = tp["name"]
+                price = tp["priceWestDenmark"]
+            except KeyError:
+                continue
+            if name is None or price is None:
+                continue
+            try:
+                totals[name] += float(price)
+                seen.add(name)
+            except (TypeError, ValueError):
+                logging.warning(f"Skipping invalid price '{price}' for {name}.")
+
+    hourly_totals = [None] * 24
+    for hour, hour_str in enumerate(_HOUR_STRS):
+        if hour_str in seen:
+            hourly_totals[hour] = round(totals[hour_str], 4)
         else:
             logging.warning(f"No price data for {hour_str} on {date_str}.")
 
-    if not hourly_totals:
-        return None
+    if hourly_totals.count(None) == 24:
+        return _stale_fallback(stale_prices, date_str)
 
-    # Cache the result
+    # Cache the result. Write to a temp file and rename it into place, so an
+    # interrupted run never leaves a truncated cache file behind
+    tmp_file = f"{cache_file}.tmp.{os.getpid()}"
     try:
-        with open(cache_file, "w") as f:
-            json.dump(hourly_totals, f)
+        with open(tmp_file, "wb") as f:
+            f.write(_dumps(hourly_totals))
+        os.replace(tmp_file, cache_file)
         logging.info(f"Cached prices for {date_str}")
     except IOError as e:
         logging.warning(f"Cache write error: {e}")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
 
     return hourly_totals
 
 
-def _format_hour_ranges(hours: list[str]) -> str:
+@functools.lru_cache(maxsize=256)
+def _format_hour_ranges(hours: tuple[int, ...]) -> str:
    
     if not hours:
         return ""
 
-    hour_ints = sorted(int(h) for h in hours)
+    hour_ints = sorted(hours)
     ranges = []
     start = hour_ints[0]
     end = start
@@ -121,13 +205,15 @@ def _format_hour_ranges(hours: list[str]) -> str:
             end = hour_ints[i]
         else:
             ranges.append(
-                f"{start:02d}:00"
+                f"{_HOUR_STRS[start]}:00"
                 if start == end
-                else f"{start:02d}:00-{(end + 1) % 24:02d}:00"
+                else f"{_HOUR_STRS[start]}:00-{_NEXT_HOUR[end]}:00"
             )
             start = end = hour_ints[i]
     ranges.append(
-        f"{start:02d}:00" if start == end else f"{start:02d}:00-{(end + 1) % 24:02d}:00"
+        f"{_HOUR_STRS[start]}:00"
+        if start == end
+        else f"{_HOUR_STRS[start]}:00-{_NEXT_HOUR[end]}:00"
     )
     return ", ".join(ranges)
 
@@ -138,62 +224,78 @@ def _ascii_sparkline(prices: list[float], width: int = 20) -> str:
     if not prices:
         return ""
     min_p, max_p = min(prices), max(prices)
-    scale = lambda p: int((p - min_p) / (max_p - min_p) * 7) if max_p > min_p else 0
-    bars = "▁▂▃▄▅▆▇█"
-    return "".join(bars[scale(p)] for p in prices)
+    if max_p == min_p:
+        return _SPARK_BARS[0] * len(prices)
+    span = max_p - min_p
+    return "".join([_SPARK_BARS[int((p - min_p) / span * 7)] for p in prices])
 
 
 def format_prices_for_display(
-    prices: dict, date_str: str, sort_by: str = None
+    prices: list, date_str: str, sort_by: str = None
 ) -> str:
     """
     Formats hourly prices with summary and optional sorting.
     Added ASCII sparkline for visual trend overview.
     """
-    if not prices:
+    present = [(h, p) for h, p in enumerate(prices or ()) if p is not None]
+    if not present:
         return f"No price data for {date_str}."
 
-    output_lines = []
-    output_lines.append(
-        f" HOURLY POWER PRICES (DK1) - {date_str} "
-    )
-
-    values = list(prices.values())
-    avg_price = sum(values) / len(values)
-    min_price = min(values)
-    max_price = max(values)
-
-    cheapest = [h for h, p in prices.items() if abs(p - min_price) < 0.00001]
-    expensive = [h for h, p in prices.items() if abs(p - max_price) < 0.00001]
-
-    output_lines.append(f"Average Price: {format_price(avg_price)} DKK/kWh")
-    output_lines.append(
-        f"Cheapest: {_format_hour_ranges(cheapest)} ({format_price(min_price)} DKK/kWh)"
+    # Lines are written newline-first so the result has no trailing newline
+    buf = io.StringIO()
+    w = buf.write
+    w(f" HOURLY POWER PRICES (DK1) - {date_str} ")
+
+    # Collect total, extremes and the hours at each extreme in one pass,
+    # seeded from the first hour. Prices are rounded to 4 decimals in
+    # fetch_prices, so equal prices compare exactly equal
+    items = iter(present)
+    first_hour, first_price = next(items)
+    total = min_price = max_price = first_price
+    cheapest = [first_hour]
+    expensive = [first_hour]
+    for h, p in items:
+        total += p
+        if p < min_price:
+            min_price = p
+            cheapest = [h]
+        elif p == min_price:
+            cheapest.append(h)
+        if p > max_price:
+            max_price = p
+            expensive = [h]
+        elif p == max_price:
+            expensive.append(h)
+    avg_price = total / len(present)
+
+    w(f"\nAverage Price: {format_price(avg_price)} DKK/kWh")
+    w(
+        f"\nCheapest: {_format_hour_ranges(tuple(cheapest))} ({format_price(min_price)} DKK/kWh)"
     )
-    output_lines.append(
-        f"Most Expensive: {_format_hour_ranges(expensive)} ({format_price(max_price)} DKK/kWh)"
+    w(
+        f"\nMost Expensive: {_format_hour_ranges(tuple(expensive))} ({format_price(max_price)} DKK/kWh)"
     )
-    output_lines.append(f"Trend Sparkline: {_ascii_sparkline(values)}")
+    w(f"\nTrend Sparkline: {_ascii_sparkline(prices)}")
 
-    # Sort hours if requested (e.g., by price or hour)
-    keys = sorted(prices)
+    # Sort hours if requested (e.g., by price or hour). Sorting (price, hour)
+    # tuples avoids a key callback per comparison; negating the price for
+    # descending order keeps ties in hour order
     if sort_by == "price":
-        keys = sorted(prices, key=prices.get)
+        hours = [h for _, h in sorted((p, h) for h, p in present)]
     elif sort_by == "price_desc":
-        keys = sorted(prices, key=prices.get, reverse=True)
+        hours = [h for _, h in sorted((-p, h) for h, p in present)]
+    else:
+        hours = [h for h, _ in present]
 
-    for hour_str in keys:
-        next_hour = f"{(int(hour_str) + 1) % 24:02d}"
-        output_lines.append(
-            f"{hour_str}:00 - {next_hour}:00 | {format_price(prices[hour_str])} DKK/kWh"
-        )
-    return "\n".join(output_lines)
+    for h in hours:
+        w(f"\n{_HOUR_STRS[h]}:00 - {_NEXT_HOUR[h]}:00 | {format_price(prices[h])} DKK/kWh")
+    return buf.getvalue()
 
 
 def format_comparison_for_display(
-    today_prices: dict,
+    today_prices: list,
     today_date_str: str,
-    yesterday_prices: dict,
+    yesterday_prices: list,
     yesterday_date_str: str,
     sort_by: str = None,
 ) -> str:
@@ -204,74 +306,80 @@ def format_comparison_for_display(
     if not today_prices or not yesterday_prices:
         return ""
 
-    comparison_lines = []
-    comparison_lines.append(
-        f" PRICE COMPARISON ({today_date_str} vs {yesterday_date_str}) "
-    )
+    # Lines are written newline-first so the result has no trailing newline
+    buf = io.StringIO()
+    w = buf.write
+    w(f" PRICE COMPARISON ({today_date_str} vs {yesterday_date_str}) ")
 
-    diffs = []
+    # One pass over the hours computes each diff, tallies its direction and
+    # renders its row; sorting and output then only shuffle finished rows
+    rows = []
+    diff_values = []
     up, down, stable = 0, 0, 0
     for hour in range(24):
-        h = f"{hour:02d}"
-        if h in today_prices and h in yesterday_prices:
-            diff = today_prices[h] - yesterday_prices[h]
-            diffs.append((h, diff))
-            if diff > 0.0001:
-                up += 1
-            elif diff < -0.0001:
-                down += 1
-            else:
-                stable += 1
-
-    if diffs:
-        avg_diff = sum(d[1] for d in diffs) / len(diffs)
-        comparison_lines.append(f"Avg Change: {format_price(avg_diff)} DKK/kWh")
-        comparison_lines.append(f"Increased: {up} | Decreased: {down} | Stable: {stable}")
-        comparison_lines.append(
-            f"Trend Sparkline (Diffs): {_ascii_sparkline([d[1] for d in diffs])}"
+        yest = yesterday_prices[hour]
+        today = today_prices[hour]
+        if yest is None or today is None:
+            continue
+        diff = today - yest
+        if diff > 0.0001:
+            up += 1
+            trend = "▲"
+        elif diff < -0.0001:
+            down += 1
+            trend = "▼"
+        else:
+            stable += 1
+            trend = "●"
+        if yest != 0:  # Handle div by zero
+            pct_chg_formatted = f"{format_price(diff / yest * 100, 2)}%"
+        else:
+            pct_chg_formatted = "N/A"
+        diff_formatted = (
+            format_price(diff) if diff >= 0 else f"-{format_price(abs(diff))}"
         )
-    comparison_lines.append(
-        "{:<11} | {:<8} | {:<8} | {:<8} | {:<8} | {:<5}".format(
-            "Hour", "Yest", "Today", "Change", "% Chg", "Trend"
+        hour_range = f"{_HOUR_STRS[hour]}:00-{_NEXT_HOUR[hour]}:00"
+        rows.append(
+            (
+                diff,
+                hour,
+                f"{hour_range:<11} | {format_price(yest):<8} | {format_price(today):<8} | "
+                f"{diff_formatted:<8} | {pct_chg_formatted:<8} | {trend:<5}",
+            )
         )
+        diff_values.append(diff)
+
+    if diff_values:
+        avg_diff = sum(diff_values) / len(diff_values)
+        w(f"\nAvg Change: {format_price(avg_diff)} DKK/kWh")
+        w(f"\nIncreased: {up} | Decreased: {down} | Stable: {stable}")
+        w(f"\nTrend Sparkline (Diffs): {_ascii_sparkline(diff_values)}")
+    w(
+        f"\n{'Hour':<11} | {'Yest':<8} | {'Today':<8} | {'Change':<8} | {'% Chg':<8} | {'Trend':<5}"
     )
 
-    # Sort by diff if requested
+    # Sort by diff if requested. Rows are (diff, hour, text) tuples and hours
+    # are unique, so the text is never compared; negating the diff for
+    # descending order keeps ties in hour order
     if sort_by == "diff":
-        diffs.sort(key=lambda x: x[1])
+        rows.sort()
     elif sort_by == "diff_desc":
-        diffs.sort(key=lambda x: x[1], reverse=True)
-
-    for hour_str, diff in diffs:
-        yest = yesterday_prices[hour_str]
-        today = today_prices[hour_str]
-        pct_chg = (diff / yest * 100) if yest != 0 else None  # Handle div by zero
-        if pct_chg is not None:
-            pct_chg_formatted = f"{format_price(pct_chg, 2)}%"
-        else:
-            pct_chg_formatted = "N/A"
-        trend = "▲" if diff > 0.0001 else "▼" if diff < -0.0001 else "●"
-        next_hour = f"{(int(hour_str) + 1) % 24:02d}"
-        comparison_lines.append(
-            "{:<11} | {:<8} | {:<8} | {:<8} | {:<8} | {:<5}".format(
-                f"{hour_str}:00-{next_hour}:00",
-                format_price(yest),
-                format_price(today),
-                format_price(diff) if diff >= 0 else f"-{format_price(abs(diff))}",
-                pct_chg_formatted,
-                trend,
-            )
-        )
-    return "\n".join(comparison_lines)
+        rows = sorted((-d, h, row) for d, h, row in rows)
 
+    if rows:
+        w("\n")
+        w("\n".join([row for _, _, row in rows]))
+    return buf.getvalue()
 
-def save_output_to_file(output_content: str, date_str: str, output_dir: str):
-    # Unchanged, but added encoding check
+
+def save_output_to_file(output_content: bytes, date_str: str, output_dir: str):
+    # Takes the report pre-encoded as UTF-8 so it is written without transcoding
     try:
         os.makedirs(output_dir, exist_ok=True)
         path = os.path.join(output_dir, f"prices_{date_str.replace('/', '')}.txt")
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(output_content + "\n")
+        with open(path, "wb") as f:
+            f.write(output_content)
+            f.write(b"\n")
         logging.info(f"Saved to {path}")
     except OSError as e:
         logging.error(f"File save error: {e}")
@@ -284,19 +392,44 @@ def send_telegram_message(message: str, bot_token: str, chat_id: str):
         return
 
     url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {"chat_id": chat_id, "text": message}
+    # Serialize the payload ourselves (UTF-8, no \u escapes for the glyphs)
+    # rather than letting requests run it through stdlib json
+    body = _dumps({"chat_id": chat_id, "text": message})
+    headers = {"Content-Type": "application/json"}
+    session = _get_session()
+    import requests  # Already loaded by _get_session()
+
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = session.post(url, data=body, headers=headers, timeout=10)
         response.raise_for_status()
-        if response.json().get("ok"):
+        if _loads(response.content).get("ok"):
             logging.info("Telegram message sent.")
         else:
             logging.error("Telegram send failed.")
-    except requests.RequestException as e:
+    except (requests.RequestException, ValueError) as e:
         logging.error(f"Telegram error: {e}")
 
 
-if __name__ == "__main__":
+def main():
+    """Command-line entry point."""
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+    from dotenv import load_dotenv
+
+    # Load .env file from the script's directory
+    load_dotenv()
+    if os.path.exists(".env"):
+        logging.info("Loaded configuration from .env file.")
+    else:
+        logging.info(".env file not found; using system environment variables or CLI args.")
+
+    # Configure logging to output to stdout by default
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        stream=sys.stdout,
+    )
+
     parser = argparse.ArgumentParser(
         description="Fetch and display hourly power prices for West Denmark from AURA API."
     )
@@ -342,15 +475,21 @@ if __name__ == "__main__":
     yesterday_dt = today_dt - timedelta(days=1)
     yesterday_str = yesterday_dt.strftime("%Y/%m/%d")
 
-    today_prices = fetch_prices(today_str)
+    # Fetch both days concurrently so the network round-trips overlap
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        today_future = executor.submit(fetch_prices, today_str)
+        yesterday_future = (
+            executor.submit(fetch_prices, yesterday_str)
+            if args.compare_yesterday
+            else None
+        )
+        today_prices = today_future.result()
+        yesterday_prices = yesterday_future.result() if yesterday_future else None
+
     if not today_prices:
         logging.error(f"Failed to fetch {today_str}. Aborting.")
         sys.exit(1)
 
-    yesterday_prices = None
-    if args.compare_yesterday:
-        yesterday_prices = fetch_prices(yesterday_str)
-
     full_output = [format_prices_for_display(today_prices, today_str, args.sort_by)]
     if args.compare_yesterday and yesterday_prices:
         comp = format_comparison_for_display(
@@ -362,9 +501,13 @@ if __name__ == "__main__":
     print(output_str)
 
     if args.output_dir:
-        save_output_to_file(output_str, today_str, args.output_dir)
+        save_output_to_file(output_str.encode("utf-8"), today_str, args.output_dir)
 
     if args.send_telegram and args.telegram_token and args.telegram_chat_id:
         send_telegram_message(output_str, args.telegram_token, args.telegram_chat_id)
     elif args.send_telegram:
         logging.warning("Missing Telegram config. Skipping.")
+
+
+if __name__ == "__main__":
+    main()